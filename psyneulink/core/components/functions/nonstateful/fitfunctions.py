@@ -1,4 +1,11 @@
+import contextlib
 import copy
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 import optuna.samplers
 from fastkde import fastKDE
@@ -38,7 +45,7 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-__all__ = ["PECOptimizationFunction", "BadLikelihoodWarning", "PECObjectiveFuncWarning"]
+__all__ = ["PECOptimizationFunction", "BadLikelihoodWarning", "PECObjectiveFuncWarning", "KDECache"]
 
 
 def get_param_str(params):
@@ -79,8 +86,109 @@ class BadLikelihoodWarning(PECObjectiveFuncWarning):
     pass
 
 
+# For numerical reasons, zero probability is replaced with a really small value. This is because we are taking logs
+# of the probabilities at the end.
+ZERO_PROB = 1e-10
+
+
+class KDECache:
+    """
+    A bounded, least recently used cache of the kernel density estimates computed by `simulation_likelihood`. Each
+    KDE grid is keyed on the exact contents of the block of simulation data it was estimated from, so byte-identical
+    blocks of simulated data (e.g. repeated evaluations of the same parameters under the same seeds) reuse the grid
+    rather than re-running the KDE.
+
+    Parameters
+    ----------
+    max_entries: The maximum number of KDE grids to keep. When full, the least recently used grid is evicted.
+
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._grids = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(data: np.ndarray):
+        """Return the key for a block of simulation data, this is a digest of its shape, dtype and contents."""
+        data = np.ascontiguousarray(data)
+        return data.shape, data.dtype.str, hashlib.blake2b(data.tobytes(), digest_size=16).digest()
+
+    def get(self, key):
+        """Return the (pdf, axes) stored for key, or None if it has not been cached."""
+        grid = self._grids.get(key)
+        if grid is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._grids.move_to_end(key)
+        return grid
+
+    def put(self, key, grid):
+        """Store the (pdf, axes) for key, evicting the least recently used grid if the cache is full."""
+        self._grids[key] = grid
+        self._grids.move_to_end(key)
+        while len(self._grids) > self.max_entries:
+            self._grids.popitem(last=False)
+
+    def clear(self):
+        self._grids.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._grids)
+
+
+# Process pools used to compute KDEs in parallel, keyed by number of workers. These are kept alive between calls to
+# simulation_likelihood because it is called once for every candidate parameter set during a fit.
+_kde_executors = {}
+
+
+def _get_kde_executor(n_jobs: int) -> ProcessPoolExecutor:
+    if n_jobs < 0:
+        n_jobs = os.cpu_count()
+    executor = _kde_executors.get(n_jobs)
+    if executor is None:
+        executor = _kde_executors[n_jobs] = ProcessPoolExecutor(max_workers=n_jobs)
+    return executor
+
+
+def _evaluate_kde(pdf, axes, points):
+    """Linear interpolation of a KDE at points, using the grid we computed the KDE on."""
+    return interpn(
+        axes,
+        pdf,
+        points,
+        method="linear",
+        bounds_error=False,
+        fill_value=ZERO_PROB,
+    )
+
+
+def _compute_kde(data, scale, points):
+    """
+    Compute the KDE of a block of simulation data and evaluate it, scaled by scale, at points (if not None). This
+    is a module level function so that it can be dispatched to a process pool.
+    """
+    fKDE = fastKDE.fastKDE(data, doSaveMarginals=False)
+    pdf = fKDE.pdf
+    axes = fKDE.axes
+
+    values = _evaluate_kde(pdf * scale, axes, points) if points is not None else None
+
+    return pdf, axes, values
+
+
 def simulation_likelihood(
-    sim_data, exp_data=None, categorical_dims=None, combine_trials=False
+    sim_data,
+    exp_data=None,
+    categorical_dims=None,
+    combine_trials=False,
+    n_jobs=1,
+    kde_cache=None,
 ):
     """
     Compute the likelihood of a simulation dataset (or the parameters that generated it) conditional
@@ -125,7 +233,15 @@ def simulation_likelihood(
         the same length as last dimension of sim_data and exp_data.
 
     combine_trials: Combine data across all trials into a single likelihood estimate, this assumes
-        that the parameters of the simulations are identical across trials.
+        that the parameters of the simulations are identical across trials. A single KDE (per category) is
+        then shared by all trials of the experimental data, and evaluated at all of them at once.
+
+    n_jobs: The number of worker processes used to construct and evaluate the per trial KDEs. If 1 (the
+        default), KDEs are computed serially in the calling process. If negative, one worker per CPU is used.
+
+    kde_cache: An optional `KDECache`. KDEs of simulation data blocks that are found in the cache are not
+        recomputed, and newly computed KDEs are added to it. Identical blocks of simulation data within a single
+        call always share one KDE, whether or not a cache is passed.
 
     Returns
     -------
@@ -152,12 +268,14 @@ def simulation_likelihood(
     if len(categories) > 10:
         raise ValueError("Too many unique values present for a categorical dimension.")
 
-    kdes = []
+    # Find the blocks of simulation data we need a KDE for. There is a separate block for each combination of trial
+    # and categorical variables. Blocks are keyed on their contents, so identical blocks only get a single KDE.
+    blocks = {}
+    trial_keys = []
     for trial in range(len(con_sim_data)):
         s = con_sim_data[trial]
 
-        # Compute a separate KDE for each combination of categorical variables.
-        dens_u = {}
+        keys_u = {}
         for category in categories:
             # Get the subset of simulations that correspond to this category
             dsub = s[cat_sim_data[trial] == category]
@@ -165,7 +283,7 @@ def simulation_likelihood(
             # If we didn't get enough simulation results for this category, don't do
             # a KDE
             if len(dsub) < 10:
-                dens_u[category] = (None, None)
+                keys_u[category] = None
                 continue
 
             # If any dimension of the data has a 0 range (all are same value) then
@@ -176,7 +294,7 @@ def simulation_likelihood(
                 else np.amax(dsub, 1) - np.amin(dsub, 1)
             )
             if np.any(data_range == 0):
-                dens_u[category] = (None, None)
+                keys_u[category] = None
                 warnings.warn(
                     BadLikelihoodWarning(
                         f"Could not perform kernel density estimate. Range of simulation data was 0 for at least "
@@ -185,26 +303,17 @@ def simulation_likelihood(
                 )
                 continue
 
-            # Do KDE
-            fKDE = fastKDE.fastKDE(dsub, doSaveMarginals=False)
-            pdf = fKDE.pdf
-            axes = fKDE.axes
-
-            # Scale the pdf by the fraction of simulations that fall within this category
-            pdf = pdf * (len(dsub) / len(s))
-
-            # Save the KDE values and axes for this category
-            dens_u[category] = (pdf, axes)
+            # The pdf is scaled by the fraction of simulations that fall within this category
+            key = KDECache.key(dsub)
+            keys_u[category] = key
+            blocks.setdefault(key, (dsub, len(dsub) / len(s)))
 
-        kdes.append(dens_u)
+        trial_keys.append(keys_u)
 
-    # If we are passed experimental data, evaluate the KDE at the experimental data points
+    # If we are passed experimental data, group its trials by the KDE they need to be evaluated against, so each KDE
+    # is evaluated at all of its experimental data points with a single interpolation.
+    exp_trials = {key: [] for key in blocks}
     if exp_data is not None:
-        # For numerical reasons, make zero probability a really small value. This is because we are taking logs
-        # of the probabilities at the end.
-        ZERO_PROB = 1e-10
-
-        kdes_eval = np.zeros((len(exp_data),))
         for trial in range(len(exp_data)):
             # Extract the categorical values for this experimental trial
             exp_trial_cat = exp_data[trial, categorical_dims]
@@ -214,24 +323,58 @@ def simulation_likelihood(
 
             # Get the right KDE for this trial, if all simulation trials have been combined
             # use that KDE for all trials of experimental data.
-            if len(kdes) == 1:
-                kde, axes = kdes[0].get(exp_trial_cat, (None, None))
-            else:
-                kde, axes = kdes[trial].get(exp_trial_cat, (None, None))
-
-            # Linear interpolation using the grid we computed the KDE
-            # on.
-            if kde is not None:
-                kdes_eval[trial] = interpn(
-                    axes,
-                    kde,
-                    exp_data[trial, ~categorical_dims],
-                    method="linear",
-                    bounds_error=False,
-                    fill_value=ZERO_PROB,
-                )
+            if len(trial_keys) == 1:
+                key = trial_keys[0].get(exp_trial_cat)
             else:
-                kdes_eval[trial] = ZERO_PROB
+                key = trial_keys[trial].get(exp_trial_cat)
+
+            if key is not None:
+                exp_trials[key].append(trial)
+
+    def exp_points(key):
+        if exp_data is None or len(exp_trials[key]) == 0:
+            return None
+        return exp_data[exp_trials[key]][:, ~categorical_dims]
+
+    # Look up the KDEs we have already computed, and compute the rest (in parallel if requested). The KDEs computed
+    # here are evaluated by the process that computes them so only the values need to be combined.
+    grids = {}
+    values = {}
+    missing = []
+    for key, (dsub, scale) in blocks.items():
+        grid = kde_cache.get(key) if kde_cache is not None else None
+        if grid is None:
+            missing.append(key)
+            continue
+
+        pdf, axes = grid
+        grids[key] = grid
+        points = exp_points(key)
+        if points is not None:
+            values[key] = _evaluate_kde(pdf * scale, axes, points)
+
+    tasks = (
+        [blocks[key][0] for key in missing],
+        [blocks[key][1] for key in missing],
+        [exp_points(key) for key in missing],
+    )
+    if n_jobs != 1 and len(missing) > 1:
+        results = _get_kde_executor(n_jobs).map(_compute_kde, *tasks)
+    else:
+        results = map(_compute_kde, *tasks)
+
+    for key, (pdf, axes, kde_values) in zip(missing, results):
+        grids[key] = (pdf, axes)
+        if kde_values is not None:
+            values[key] = kde_values
+        if kde_cache is not None:
+            kde_cache.put(key, (pdf, axes))
+
+    # If we are passed experimental data, return the KDEs evaluated at the experimental data points
+    if exp_data is not None:
+        kdes_eval = np.full((len(exp_data),), ZERO_PROB)
+        for key, kde_values in values.items():
+            kdes_eval[exp_trials[key]] = kde_values
 
         # Check to see if any of the trials have non-zero likelihood, if not, something is probably wrong
         # and we should warn the user.
@@ -252,9 +395,30 @@ def simulation_likelihood(
         return kdes_eval
 
     else:
+        # Save the scaled KDE values and axes for each category of each trial
+        kdes = []
+        for keys_u in trial_keys:
+            dens_u = {}
+            for category, key in keys_u.items():
+                if key is None:
+                    dens_u[category] = (None, None)
+                else:
+                    pdf, axes = grids[key]
+                    dens_u[category] = (pdf * blocks[key][1], axes)
+            kdes.append(dens_u)
+
         return kdes
 
 
+# Trials that count towards max_iterations of an Optuna study. Trials left running by a fit that was interrupted
+# are not counted, and are effectively re-run when the study is resumed.
+_FINISHED_TRIAL_STATES = (optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+
+
+def _num_finished_trials(study):
+    return len(study.get_trials(deepcopy=False, states=_FINISHED_TRIAL_STATES))
+
+
 class PECOptimizationFunction(OptimizationFunction):
     """
     A subclass of OptimizationFunction that is used to interface with the PEC. This class is used to specify the
@@ -287,6 +451,21 @@ class PECOptimizationFunction(OptimizationFunction):
         Whether to maximize or minimize the objective function. If 'maximize', the objective function is maximized. If
         'minimize', the objective function is minimized.
 
+    storage :
+        Only used with optuna. The path of an SQLite file (or any Optuna RDB storage URL) in which the study is
+        persisted. If the file already contains a study named **study_name**, it is resumed and only the trials
+        remaining of **max_iterations** are run, so a fit that was interrupted can be continued. If None (the
+        default), the study is kept in memory.
+
+    study_name :
+        Only used with optuna. The name of the study in **storage**.
+
+    n_jobs :
+        Only used with optuna. The number of processes that run trials of the study concurrently. Additional
+        worker processes are forked from the calling process, so each has its own copy of the model (and any code
+        compiled for it), and they share the study through **storage** (a temporary SQLite file if **storage** is
+        not specified). Requires a platform that supports the 'fork' start method.
+
 
     """
     class Parameters(OptimizationFunction.Parameters):
@@ -303,10 +482,27 @@ class PECOptimizationFunction(OptimizationFunction):
         save_values: Optional[bool] = None,
         max_iterations: int = 500,
         direction: Literal["maximize", "minimize"] = "maximize",
+        storage: Optional[str] = None,
+        study_name: str = "PECOptimizationFunction",
+        n_jobs: int = 1,
         **kwargs,
     ):
+        if not isinstance(method, optuna.samplers.BaseSampler) and (storage is not None or n_jobs != 1):
+            raise ValueError(
+                f"The storage and n_jobs arguments are only supported for optuna samplers, not '{method}'."
+            )
+
+        if n_jobs < 1:
+            raise ValueError(f"n_jobs must be a positive integer, got {n_jobs}.")
+
+        if n_jobs > 1 and "fork" not in multiprocessing.get_all_start_methods():
+            raise ValueError("n_jobs > 1 requires a platform that supports the 'fork' start method.")
+
         self.method = method
         self.direction = direction
+        self.storage = storage
+        self.study_name = study_name
+        self.n_jobs = n_jobs
 
         # The outcome variables to select from the composition's output need to be specified. These will be
         # set automatically by the PEC when PECOptimizationFunction is passed to it.
@@ -456,12 +652,14 @@ class PECOptimizationFunction(OptimizationFunction):
         # Reset the search grid
         self.reset_grid(context)
 
-        # Evaluate objective_function for each sample
+        # Evaluate objective_function for each sample. The composition might have more outputs than outcome
+        # variables, only the ones we need are kept.
         last_sample, last_value, all_samples, all_values = self._evaluate(
             variable=variable,
             context=context,
             params=None,
             fit_evaluate=True,
+            result_indices=self.outcome_variable_indices,
         )
 
         # We need to swap the simulation (randomization dimension) with the output dimension so things
@@ -480,9 +678,6 @@ class PECOptimizationFunction(OptimizationFunction):
         def objfunc(*args):
             sim_data = self._run_simulations(*args, context=context)
 
-            # The composition might have more outputs than outcome variables, we need to subset the ones we need.
-            sim_data = sim_data[:, :, self.outcome_variable_indices]
-
             return self._pec_objective_function(sim_data)
 
         return objfunc
@@ -735,6 +930,55 @@ class PECOptimizationFunction(OptimizationFunction):
 
         return output_dict
 
+    def _make_optuna_storage(self, url: str):
+        """
+        Create the RDB storage for an Optuna study. SQLite serializes writers, so give concurrent worker processes
+        a generous timeout for acquiring the database lock.
+        """
+        engine_kwargs = {"connect_args": {"timeout": 60}} if url.startswith("sqlite") else None
+        return optuna.storages.RDBStorage(url, engine_kwargs=engine_kwargs)
+
+    def _make_optuna_objective(self, objfunc_wrapper):
+        """
+        Optuna has an interface where the objective function calls the API to get
+        the current values for the parameter rather than them being passed
+        directly. So we need to wrap the wrapper
+        """
+        def objfunc_wrapper_wrapper(trial):
+            for name, (lower, upper, step) in self.fit_param_bounds.items():
+                trial.suggest_float(name, lower, upper, step=step)
+
+            return objfunc_wrapper(list(trial.params.values()))
+
+        return objfunc_wrapper_wrapper
+
+    def _optuna_worker(self, obj_func, opt_func, storage_url, study_name, max_iterations, seed):
+        """
+        Run trials of an existing Optuna study from a forked worker process. The worker has its own copy of the
+        model (and any compiled code for it), and shares only the study storage with the other workers. Progress
+        is reported by the parent process, which counts the trials finished by all workers.
+        """
+        objfunc_wrapper = self._make_obj_func_wrapper(
+            progress=None,
+            display_iter=False,
+            warns=[],
+            warns_with_params=[],
+            obj_func=obj_func,
+            ignore_direction=True,
+        )
+
+        opt_func._rng = np.random.RandomState(seed)
+        study = optuna.load_study(
+            study_name=study_name,
+            storage=self._make_optuna_storage(storage_url),
+            sampler=opt_func,
+        )
+        study.optimize(
+            self._make_optuna_objective(objfunc_wrapper),
+            n_trials=max_iterations,
+            callbacks=[optuna.study.MaxTrialsCallback(max_iterations, states=_FINISHED_TRIAL_STATES)],
+        )
+
     def _fit_optuna(
         self,
         obj_func: Callable,
@@ -753,7 +997,7 @@ class PECOptimizationFunction(OptimizationFunction):
             progress.update(opt_task, completed=0)
 
             warns_with_params = []
-            with warnings.catch_warnings(record=True) as warns:
+            with warnings.catch_warnings(record=True) as warns, contextlib.ExitStack() as stack:
                 # Create a wrapper for the objective function that will let us catch warnings and record progress.
                 # For optuna, we can ignore the direction of search because it is handled by the Optuna API when
                 # setting up the optimization.
@@ -766,14 +1010,7 @@ class PECOptimizationFunction(OptimizationFunction):
                     ignore_direction=True,
                 )
 
-                # Optuna has an interface where the objective function calls the API to get
-                # the current values for the parameter rather than them being passed
-                # directly. So we need to wrap the wrapper
-                def objfunc_wrapper_wrapper(trial):
-                    for name, (lower, upper, step) in self.fit_param_bounds.items():
-                        trial.suggest_float(name, lower, upper, step=step)
-
-                    return objfunc_wrapper(list(trial.params.values()))
+                objfunc_wrapper_wrapper = self._make_optuna_objective(objfunc_wrapper)
 
                 self._best_params = {}
 
@@ -802,24 +1039,88 @@ class PECOptimizationFunction(OptimizationFunction):
                             style="bold red",
                         )
 
-                    progress.update(opt_task, advance=1)
+                    # Trials are also completed by any other worker processes, so count them in the study
+                    progress.update(opt_task, completed=_num_finished_trials(study))
 
                 # We need to hook into Optuna's random number generator here so that we can allow PsyNeuLink's RNS to
                 # determine the seed for Optuna's RNG. Pretty hacky unfortunately.
-                opt_func._rng = np.random.RandomState(self.owner.initial_seed)
+                initial_seed = try_extract_0d_array_item(self.owner.initial_seed)
+                opt_func._rng = np.random.RandomState(initial_seed)
 
                 # Turn off optuna logging except for errors or warnings, it doesn't work well with our PNL progress bar
                 optuna.logging.set_verbosity(optuna.logging.WARNING)
 
+                # Worker processes can only share a study through storage, so if none was specified use a temporary
+                # SQLite file for the duration of the fit.
+                storage_url = self.storage
+                if storage_url is None and self.n_jobs > 1:
+                    tmp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+                    storage_url = os.path.join(tmp_dir, "study.db")
+                if storage_url is not None and "://" not in storage_url:
+                    storage_url = f"sqlite:///{os.path.abspath(storage_url)}"
+
                 study = optuna.create_study(
-                    sampler=opt_func, direction=self.direction
+                    sampler=opt_func,
+                    direction=self.direction,
+                    storage=self._make_optuna_storage(storage_url) if storage_url is not None else None,
+                    study_name=self.study_name if storage_url is not None else None,
+                    load_if_exists=True,
                 )
+
+                # If we are resuming a study, only run the trials that remain
+                num_finished = _num_finished_trials(study)
+                progress.update(opt_task, completed=num_finished)
+                if num_finished > 0:
+                    progress.console.print(
+                        f"Resuming study '{study.study_name}' with {num_finished} of {max_iterations} trials completed."
+                    )
+
+                workers = []
+                if self.n_jobs > 1 and num_finished < max_iterations:
+                    # Workers must be forked so that each gets its own copy of the model (and any code compiled for
+                    # it) without having to pickle the Composition.
+                    mp_context = multiprocessing.get_context("fork")
+                    for i in range(1, self.n_jobs):
+                        worker = mp_context.Process(
+                            target=self._optuna_worker,
+                            args=(
+                                obj_func,
+                                opt_func,
+                                storage_url,
+                                study.study_name,
+                                max_iterations,
+                                initial_seed + i if initial_seed is not None else None,
+                            ),
+                            daemon=True,
+                        )
+                        worker.start()
+                        workers.append(worker)
+
                 study.optimize(
                     objfunc_wrapper_wrapper,
-                    n_trials=max_iterations,
-                    callbacks=[progress_callback],
+                    n_trials=max(max_iterations - num_finished, 0),
+                    callbacks=[
+                        optuna.study.MaxTrialsCallback(max_iterations, states=_FINISHED_TRIAL_STATES),
+                        progress_callback,
+                    ],
                 )
 
+                for worker in workers:
+                    worker.join()
+
+                failed = [i + 1 for i, worker in enumerate(workers) if worker.exitcode != 0]
+                if failed:
+                    raise OptimizationFunctionError(
+                        f"Optuna worker process(es) {failed} of {self.name} exited with an error. "
+                        + (
+                            f"Completed trials are saved in '{self.storage}' and the fit can be resumed."
+                            if self.storage is not None
+                            else "Specify a storage to be able to resume the fit."
+                        )
+                    )
+
+                progress.update(opt_task, completed=_num_finished_trials(study))
+
             # Bind the fitted parameters to their names
             fitted_params = dict(
                 zip(list(self.fit_param_names), study.best_params.values())
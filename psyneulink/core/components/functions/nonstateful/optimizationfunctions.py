@@ -608,13 +608,16 @@ class OptimizationFunction(Function_Base):
         raise NotImplementedError("OptimizationFunction._function is not implemented and "
                                   "should be overridden by subclasses.")
 
-    def _evaluate(self, variable=None, context=None, params=None, fit_evaluate=False):
+    def _evaluate(self, variable=None, context=None, params=None, fit_evaluate=False, result_indices=None):
         """
         Evaluate all the sample in a `search_space <OptimizationFunction.search_space>` with the agent_rep. The
         evaluation is done either serially (_sequential_evaluate) or in parallel (_grid_evaluate). This method should
         be invoked by subclasses in their `_function` method to evaluate the samples before searching for the optimal
         value.
 
+        If **fit_evaluate** is True, the results of all trials of every evaluation are returned, and
+        **result_indices** can be used to select the outputs of the agent_rep that are kept.
+
         Returns
         -------
 
@@ -642,34 +645,11 @@ class OptimizationFunction(Function_Base):
         if self.owner and self.owner.parameters.comp_execution_mode._get(context) != 'Python' and \
           ContextFlags.PROCESSING in context.flags:
             all_samples = [s for s in itertools.product(*self.search_space)]
-            all_values, num_evals = self._grid_evaluate(self.owner, context, fit_evaluate)
+            all_values, num_evals = self._grid_evaluate(self.owner, context, fit_evaluate, result_indices)
             assert len(all_values) == num_evals
             assert len(all_samples) == num_evals
 
             if fit_evaluate:
-                all_values = np.ctypeslib.as_array(all_values)
-                # print("OLD DTYPE:", all_values.dtype)
-                # print("OLD SHAPE:", all_values.shape)
-
-                def _get_builtin_dtype(dtype):
-    #                print("CHECKING:", dtype, "FIELDS:", dtype.names, "SUBDTYPE:", dtype.subdtype, "BASE:", dtype.base)
-                    if dtype.isbuiltin:
-                        return dtype
-
-                    if dtype.subdtype is not None:
-                        return dtype.base
-
-                    subdtypes = (v[0] for v in dtype.fields.values())
-                    first_builtin = _get_builtin_dtype(next(subdtypes))
-                    assert all(_get_builtin_dtype(sdt) is first_builtin for sdt in subdtypes)
-                    return first_builtin
-
-                dtype = _get_builtin_dtype(all_values.dtype)
-                # Ignore the shape of the output structure
-                all_values = all_values.view(dtype=dtype).reshape((*all_values.shape[0:2], -1))
-                # print("NEW DTYPE:", all_values.dtype)
-                # print("NEW SHAPE:", all_values.shape)
-
                 # Re-arrange dimensions to match Python
                 all_values = np.transpose(all_values, (1, 2, 0))
 
@@ -686,6 +666,8 @@ class OptimizationFunction(Function_Base):
             last_sample, last_value, all_samples, all_values = self._sequential_evaluate(initial_sample,
                                                                                          initial_value,
                                                                                          context)
+            if fit_evaluate and result_indices is not None:
+                all_values = all_values[:, result_indices, :]
 
         # If  aggregation_function is specified and there is a randomization dimension specified
         # in the control signals; use the aggregation function to aggregate over the samples generated
@@ -808,8 +790,14 @@ class OptimizationFunction(Function_Base):
         # FIX: 11/3/21: ??MODIFY TO RETURN SAME AS _grid_evaluate
         return current_sample, current_value, evaluated_samples, estimated_values
 
-    def _grid_evaluate(self, ocm, context, get_results:bool):
-        """Helper method for evaluation of a grid of samples from search space via LLVM backends."""
+    def _grid_evaluate(self, ocm, context, get_results:bool, result_indices=None):
+        """Helper method for evaluation of a grid of samples from search space via LLVM backends.
+
+        If **get_results** is True, returns an array with the results of all trials of every evaluation, of shape
+        (evaluations, trials, outputs), keeping only the outputs in **result_indices** if it is specified. With the
+        LLVM backend the evaluations are run in chunks of bounded size, and only the selected outputs of each chunk
+        are kept, so the full results structure of every evaluation is never held in memory at once.
+        """
         # If execution mode is not Python, the search space has to be static
         def _is_static(it:SampleIterator):
             if isinstance(it.start, Number) and isinstance(it.stop, Number):
@@ -835,6 +823,15 @@ class OptimizationFunction(Function_Base):
         execution_mode = ocm.parameters.comp_execution_mode._get(context)
         if execution_mode == "PTX":
             outcomes = comp_exec.cuda_evaluate(inputs, num_inputs_sets, num_evals, get_results)
+            if get_results:
+                outcomes = _results_to_array(outcomes, num_evals, result_indices)
+        elif execution_mode == "LLVM" and get_results:
+            outcomes = None
+            for start, stop, ct_results in comp_exec.thread_evaluate_chunks(inputs, num_inputs_sets, num_evals):
+                chunk_values = _results_to_array(ct_results, stop - start, result_indices)
+                if outcomes is None:
+                    outcomes = np.empty((num_evals, *chunk_values.shape[1:]), dtype=chunk_values.dtype)
+                outcomes[start:stop] = chunk_values
         elif execution_mode == "LLVM":
             outcomes = comp_exec.thread_evaluate(inputs, num_inputs_sets, num_evals, get_results)
         else:
@@ -885,6 +882,34 @@ class OptimizationFunction(Function_Base):
             return self.search_space[self.randomization_dimension].num
 
 
+def _get_builtin_dtype(dtype):
+    if dtype.isbuiltin:
+        return dtype
+
+    if dtype.subdtype is not None:
+        return dtype.base
+
+    subdtypes = (v[0] for v in dtype.fields.values())
+    first_builtin = _get_builtin_dtype(next(subdtypes))
+    assert all(_get_builtin_dtype(sdt) is first_builtin for sdt in subdtypes)
+    return first_builtin
+
+
+def _results_to_array(ct_results, num_evals, result_indices=None):
+    """Convert the first num_evals elements of the ctype array of all results of compiled evaluations to an array of
+    shape (evaluations, trials, outputs), keeping only the outputs in result_indices if it is not None.
+    """
+    all_values = np.ctypeslib.as_array(ct_results)[:num_evals]
+    dtype = _get_builtin_dtype(all_values.dtype)
+
+    # Ignore the shape of the output structure
+    all_values = all_values.view(dtype=dtype).reshape((*all_values.shape[0:2], -1))
+    if result_indices is not None:
+        all_values = all_values[:, :, result_indices]
+
+    return all_values
+
+
 ASCENT = 'ascent'
 DESCENT = 'descent'
 
@@ -174,6 +174,7 @@ from psyneulink.core.components.mechanisms.modulatory.control.optimizationcontro
     OptimizationControlMechanism,
 )
 from psyneulink.core.components.functions.nonstateful.fitfunctions import (
+    KDECache,
     PECOptimizationFunction,
     simulation_likelihood,
 )
@@ -257,6 +258,11 @@ class ParameterEstimationComposition(Composition):
         all data dimensions are assumed to be continuous. Alternatively, if data is a pandas DataFrame, then the columns
         which have Category dtype are assumed to be categorical.
 
+    likelihood_n_jobs : int : default 1
+        specifies the number of worker processes used to construct and evaluate the per trial kernel density
+        estimates when computing the likelihood of the **data** (see `simulation_likelihood`). If 1, they are
+        computed serially; if negative, one worker per CPU is used. Ignored if **data** is not specified.
+
     objective_function : ObjectiveFunction, function or method
         specifies the function used by **optimization_function** (see `objective_function
         <ParameterEstimationComposition.objective_function>` for additional information);  the shape of its `variable
@@ -461,6 +467,7 @@ class ParameterEstimationComposition(Composition):
         model: Optional[Composition] = None,
         data: Optional[pd.DataFrame] = None,
         data_categorical_dims=None,
+        likelihood_n_jobs: int = 1,
         objective_function: Optional[Callable] = None,
         num_estimates: int = 1,
         num_trials_per_estimate: Optional[int] = None,
@@ -528,6 +535,11 @@ class ParameterEstimationComposition(Composition):
         # Store the data used to fit the model, None if in OptimizationMode (the default)
         self.data = data
         self.data_categorical_dims = data_categorical_dims
+        self.likelihood_n_jobs = likelihood_n_jobs
+
+        # Kernel density estimates of the simulation data, reused when the same simulated data is seen again
+        # (e.g. the same parameters are evaluated more than once with the same seeds).
+        self._kde_cache = KDECache()
 
         if not isinstance(self.nodes[0], Composition):
             raise ValueError(
@@ -746,6 +758,8 @@ class ParameterEstimationComposition(Composition):
                     sim_data=sim_data,
                     exp_data=self._data_numpy,
                     categorical_dims=self.data_categorical_dims,
+                    n_jobs=self.likelihood_n_jobs,
+                    kde_cache=self._kde_cache,
                 )
 
                 return np.sum(np.log(like))
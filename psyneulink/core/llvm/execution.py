@@ -833,11 +833,12 @@ class CompExecution(CUDAExecution):
 
         return ct_results
 
-    def thread_evaluate(self, inputs, num_input_sets, num_evaluations, all_results:bool=False):
-        ct_param, ct_state, ct_data, ct_inputs, out_ty, ct_num_inputs = \
-            self._prepare_evaluate(inputs, num_input_sets, num_evaluations, all_results)
-
-        ct_results = out_ty()
+    def _thread_evaluate_range(self, ct_param, ct_state, ct_data, ct_inputs, ct_num_inputs,
+                               results_address, start, stop):
+        # The compiled function indexes results by the absolute evaluation
+        # index, so results_address is the (possibly virtual) location of
+        # the result of evaluation 0.
+        num_evaluations = stop - start
         jobs = min(os.cpu_count(), num_evaluations)
         evals_per_job = (num_evaluations + jobs - 1) // jobs
 
@@ -847,13 +848,13 @@ class CompExecution(CUDAExecution):
             # Create input and result typed casts once, they are the same
             # for every submitted job.
             input_param = ctypes.cast(ctypes.byref(ct_inputs), self.__bin_func.c_func.argtypes[5])
-            results_param = ctypes.cast(ct_results, self.__bin_func.c_func.argtypes[4])
+            results_param = ctypes.cast(results_address, self.__bin_func.c_func.argtypes[4])
 
             # There are 7 arguments to evaluate_alloc_range:
             # comp_param, comp_state, from, to, results, input, comp_data
             results = [ex.submit(self.__bin_func, ct_param, ct_state,
-                                 int(i * evals_per_job),
-                                 min((i + 1) * evals_per_job, num_evaluations),
+                                 int(start + i * evals_per_job),
+                                 min(start + (i + 1) * evals_per_job, stop),
                                  results_param,
                                  input_param,
                                  ct_data,
@@ -870,4 +871,44 @@ class CompExecution(CUDAExecution):
         exceptions = [r.exception() for r in results]
         assert all(e is None for e in exceptions), "Not all jobs finished sucessfully: {}".format(exceptions)
 
+    def thread_evaluate(self, inputs, num_input_sets, num_evaluations, all_results:bool=False):
+        ct_param, ct_state, ct_data, ct_inputs, out_ty, ct_num_inputs = \
+            self._prepare_evaluate(inputs, num_input_sets, num_evaluations, all_results)
+
+        ct_results = out_ty()
+        self._thread_evaluate_range(ct_param, ct_state, ct_data, ct_inputs, ct_num_inputs,
+                                    ctypes.addressof(ct_results), 0, num_evaluations)
+
         return ct_results
+
+    def thread_evaluate_chunks(self, inputs, num_input_sets, num_evaluations,
+                               max_chunk_bytes:int=2**28):
+        """Generate all results of evaluations in bounded memory chunks.
+
+        Yields (start, stop, results) for consecutive ranges of evaluations,
+        where results is a ctype array holding the results of evaluations
+        [start, stop) in its first stop - start elements. The same buffer
+        is reused for every chunk, so its contents need to be consumed (or
+        copied) before the next chunk is requested.
+        """
+        ct_param, ct_state, ct_data, ct_inputs, out_ty, ct_num_inputs = \
+            self._prepare_evaluate(inputs, num_input_sets, num_evaluations, True)
+
+        out_el_ty = out_ty._type_
+        el_size = ctypes.sizeof(out_el_ty)
+        chunk_evaluations = max(1, min(num_evaluations, max_chunk_bytes // el_size))
+        ct_results = (out_el_ty * chunk_evaluations)()
+
+        if "stat" in self._debug_env:
+            print("Evaluate result chunk size:", _pretty_size(ctypes.sizeof(ct_results)),
+                  "( evaluations:", chunk_evaluations, ")", "for", self._obj.name)
+
+        # Offset the results pointer so that the result of evaluation
+        # 'start' is written to the first element of the chunk.
+        address_mask = (1 << (8 * ctypes.sizeof(ctypes.c_void_p))) - 1
+        for start in range(0, num_evaluations, chunk_evaluations):
+            stop = min(start + chunk_evaluations, num_evaluations)
+            results_address = (ctypes.addressof(ct_results) - start * el_size) & address_mask
+            self._thread_evaluate_range(ct_param, ct_state, ct_data, ct_inputs, ct_num_inputs,
+                                        results_address, start, stop)
+            yield start, stop, ct_results
@@ -6,7 +6,9 @@ import optuna
 import psyneulink as pnl
 
 from psyneulink.core.components.functions.nonstateful.fitfunctions import (
+    KDECache,
     PECOptimizationFunction,
+    simulation_likelihood,
 )
 
 
@@ -403,3 +405,161 @@ def test_pec_controller_specified():
             optimization_function="differential_evolution",
             controller=pnl.ControlMechanism(),
         )
+
+
+@pytest.mark.composition
+@pytest.mark.parametrize("combine_trials", [False, True])
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_simulation_likelihood_parallel_and_cached(combine_trials, n_jobs):
+    """Test that computing KDEs in parallel or from the cache doesn't change the likelihood."""
+    rng = np.random.default_rng(12345)
+    num_trials, num_estimates = 6, 200
+
+    # A categorical decision column and a continuous response time column
+    sim_data = np.empty((num_trials, num_estimates, 2))
+    sim_data[:, :, 0] = rng.integers(0, 2, size=(num_trials, num_estimates))
+    sim_data[:, :, 1] = rng.gamma(2.0, 0.3, size=(num_trials, num_estimates))
+
+    # Two identical trials of simulation data should share a KDE
+    sim_data[1] = sim_data[0]
+
+    exp_data = np.empty((num_trials, 2))
+    exp_data[:, 0] = rng.integers(0, 2, size=num_trials)
+    exp_data[:, 1] = rng.gamma(2.0, 0.3, size=num_trials)
+
+    categorical_dims = [True, False]
+    expected = simulation_likelihood(
+        sim_data, exp_data, categorical_dims, combine_trials=combine_trials
+    )
+
+    cache = KDECache()
+    like = simulation_likelihood(
+        sim_data, exp_data, categorical_dims, combine_trials=combine_trials, n_jobs=n_jobs, kde_cache=cache
+    )
+    np.testing.assert_array_equal(like, expected)
+
+    num_kdes = 2 if combine_trials else 2 * (num_trials - 1)
+    assert len(cache) == num_kdes
+    assert cache.misses == num_kdes
+
+    like = simulation_likelihood(
+        sim_data, exp_data, categorical_dims, combine_trials=combine_trials, n_jobs=n_jobs, kde_cache=cache
+    )
+    np.testing.assert_array_equal(like, expected)
+    assert cache.hits == num_kdes
+
+
+@pytest.mark.composition
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_pec_optuna_storage_resume(func_mode, tmp_path, n_jobs):
+    """Test that an optuna study persisted to storage is resumed, and can be shared by worker processes."""
+
+    if func_mode == "Python":
+        pytest.skip(
+            "Test not yet implemented for Python. Parameter estimation is too slow."
+        )
+
+    storage = str(tmp_path / "study.db")
+
+    def run_pec(max_iterations):
+        decision = pnl.DDM(
+            function=pnl.DriftDiffusionIntegrator(noise=1.0, threshold=0.6, time_step_size=0.1),
+            output_ports=[pnl.DECISION_OUTCOME, pnl.RESPONSE_TIME],
+            name="DDM",
+        )
+        comp = pnl.Composition(pathways=decision)
+        pec = pnl.ParameterEstimationComposition(
+            name="pec",
+            nodes=comp,
+            parameters={("threshold", decision): np.linspace(0.1, 1.0, 10)},
+            outcome_variables=[
+                decision.output_ports[pnl.DECISION_OUTCOME],
+                decision.output_ports[pnl.RESPONSE_TIME],
+            ],
+            objective_function=lambda sim_data: np.mean(sim_data[:, :, 0] / sim_data[:, :, 1]),
+            optimization_function=PECOptimizationFunction(
+                method=optuna.samplers.RandomSampler(seed=0),
+                max_iterations=max_iterations,
+                storage=storage,
+                study_name="threshold",
+                n_jobs=n_jobs,
+            ),
+            num_estimates=5,
+            initial_seed=42,
+        )
+        pec.controller.parameters.comp_execution_mode.set(func_mode)
+        pec.run(inputs={comp: [[1.0]]})
+        return pec
+
+    run_pec(4)
+    study = optuna.load_study(study_name="threshold", storage=f"sqlite:///{storage}")
+    first_trials = study.trials
+    assert 4 <= len(first_trials) < 4 + n_jobs
+
+    # Resuming the study with a larger budget only runs the remaining trials
+    pec = run_pec(8)
+    study = optuna.load_study(study_name="threshold", storage=f"sqlite:///{storage}")
+    assert 8 <= len(study.trials) < 8 + n_jobs
+    assert [t.params for t in study.trials[:len(first_trials)]] == [t.params for t in first_trials]
+    np.testing.assert_allclose(pec.optimized_parameter_values, list(study.best_params.values()))
+
+
+@pytest.mark.composition
+def test_pec_optuna_storage_requires_optuna():
+    with pytest.raises(ValueError, match="only supported for optuna samplers"):
+        PECOptimizationFunction(method="differential_evolution", storage="study.db")
+
+
+@pytest.mark.composition
+@pytest.mark.llvm
+def test_pec_chunked_evaluate_results(monkeypatch):
+    """Test that simulation results are the same when compiled evaluations are streamed in small chunks."""
+
+    def simulate(max_chunk_bytes):
+        monkeypatch.setattr(
+            pnl.core.llvm.execution.CompExecution.thread_evaluate_chunks,
+            "__defaults__",
+            (max_chunk_bytes,),
+        )
+
+        # Construct the model with the same seeds every time
+        pnl.core.globals.utilities.set_global_seed(0)
+        decision = pnl.DDM(
+            function=pnl.DriftDiffusionIntegrator(noise=1.0, threshold=0.6, time_step_size=0.1),
+            output_ports=[pnl.DECISION_OUTCOME, pnl.RESPONSE_TIME],
+            name="DDM",
+        )
+        comp = pnl.Composition(pathways=decision)
+
+        sim_data = []
+
+        def objective_function(x):
+            sim_data.append(x)
+            return np.mean(x[:, :, 0])
+
+        pec = pnl.ParameterEstimationComposition(
+            name="pec",
+            nodes=comp,
+            parameters={("threshold", decision): np.linspace(0.1, 1.0, 10)},
+            outcome_variables=[decision.output_ports[pnl.RESPONSE_TIME]],
+            objective_function=objective_function,
+            optimization_function=PECOptimizationFunction(
+                method=optuna.samplers.RandomSampler(seed=0), max_iterations=2
+            ),
+            num_estimates=7,
+            initial_seed=42,
+        )
+        pec.controller.parameters.comp_execution_mode.set("LLVM")
+        pec.run(inputs={comp: [[1.0], [-1.0], [1.0]]})
+
+        return np.stack(sim_data)
+
+    expected = simulate(2**28)
+
+    # Only the outcome variable (response time) is returned for each trial and estimate
+    assert expected.shape == (2, 3, 7, 1)
+
+    # Chunks of a single evaluation, and of 3 evaluations (3 trials of 2 double outputs each), which doesn't divide
+    # num_estimates
+    np.testing.assert_array_equal(simulate(1), expected)
+    np.testing.assert_array_equal(simulate(3 * 3 * 2 * 8), expected)